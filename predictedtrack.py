@@ -1,126 +1,259 @@
+import io
+import math
+
 import streamlit as st
+import streamlit.components.v1 as components
 from st_paywall import add_auth
+import numpy as np
+import orjson
 import pandas as pd
-from geopy.distance import distance
-import folium
-from streamlit_folium import folium_static
-import simplekml
+import pyarrow as pa
+import pyarrow.csv as pacsv
+from numba import njit, prange
 
 st.set_page_config(layout="wide")
 st.title("Aircraft Predicted Trajectory Algorithm")
 
+# Mean Earth radius in meters and knots -> m/s conversion factor
+EARTH_RADIUS_METERS = 6371008.8
+KNOTS_TO_METERS_PER_SECOND = 0.514444
+
+# Tracks shorter than this aren't worth the parallel kernel's thread setup;
+# the latitude-span limit keeps its tangent-plane approximation honest
+_PARALLEL_MIN_STEPS = 10000
+_PARALLEL_MAX_LAT_SPAN_RAD = math.radians(3.0)
+
 add_auth(required=True)
 
 # ONLY AFTER THE AUTHENTICATION + SUBSCRIPTION, THE USER WILL SEE THIS ⤵
 # The email and subscription status is stored in session state.
-st.write(f"Subscription Status: {st.session_state.user_subscribed}")
-st.write("🎉 Yay! You're all set and subscribed! 🎉")
-st.write(f'By the way, your email is: {st.session_state.email}')
-
-# Function to calculate new coordinates based on initial coordinates, ground speed, and bearing
-def calculate_new_coordinates(initial_lat, initial_lon, bearing, ground_speed_knots, time_interval_seconds):
-    # Convert ground speed from knots to meters per second
-    ground_speed_meters_per_second = ground_speed_knots * 0.514444  # knots to meters per second
-
-    # Calculate horizontal distance traveled in the given time interval
-    horizontal_distance_traveled = ground_speed_meters_per_second * time_interval_seconds  # distance in meters
-
-    # Convert horizontal distance traveled to kilometers (for geopy)
-    horizontal_distance_traveled_km = horizontal_distance_traveled / 1000
-
-    # Calculate new coordinates using geopy's distance and destination method
-    destination = distance(kilometers=horizontal_distance_traveled_km).destination((initial_lat, initial_lon), bearing)
-    new_lat, new_lon = destination.latitude, destination.longitude
-
-    return new_lat, new_lon
-
-# Read input CSV file and predict coordinates
-def read_csv_and_predict(input_csv, initial_lat, initial_lon, time_interval_seconds=1):
-    df = pd.read_csv(input_csv)  # Read CSV file using provided path
+# Shown once per session; reruns triggered by widget changes skip it.
+if 'auth_rendered' not in st.session_state:
+    st.write(f"Subscription Status: {st.session_state.user_subscribed}")
+    st.write("🎉 Yay! You're all set and subscribed! 🎉")
+    st.write(f'By the way, your email is: {st.session_state.email}')
+    st.session_state.auth_rendered = True
+
+# Build (and warm up) the compiled trajectory integrator once per process.
+# Streamlit re-executes this module on every widget interaction; caching the
+# kernel as a resource means reruns get the already-bound compiled function
+# instead of paying Numba's dispatcher setup again.
+@st.cache_resource
+def _get_integrator():
+    # Steps the spherical forward formula over every (groundspeed, heading)
+    # pair, returning the full track including the initial point. cache=True
+    # persists the compiled kernel across app restarts; nogil=True lets a
+    # thread pool integrate several tracks concurrently.
+    @njit(cache=True, fastmath=True, nogil=True)
+    def _integrate(ground_speed_knots, heading_deg, initial_lat, initial_lon, time_interval_seconds):
+        n = ground_speed_knots.shape[0]
+        lats = np.empty(n + 1, dtype=np.float64)
+        lons = np.empty(n + 1, dtype=np.float64)
+        lats[0] = initial_lat
+        lons[0] = initial_lon
+
+        # Loop-invariant: converts knots directly to angular distance per step
+        step_scale = KNOTS_TO_METERS_PER_SECOND * time_interval_seconds / EARTH_RADIUS_METERS
+
+        current_lat = math.radians(initial_lat)
+        current_lon = math.radians(initial_lon)
+        for i in range(n):
+            # Angular distance traveled this step (radians on a spherical Earth)
+            d = ground_speed_knots[i] * step_scale
+            heading = math.radians(heading_deg[i])
+            sin_d = math.sin(d)
+            cos_d = math.cos(d)
+            sin_lat1 = math.sin(current_lat)
+            cos_lat1 = math.cos(current_lat)
+            sin_lat2 = sin_lat1 * cos_d + cos_lat1 * sin_d * math.cos(heading)
+            current_lat = math.asin(sin_lat2)
+            current_lon += math.atan2(math.sin(heading) * sin_d * cos_lat1, cos_d - sin_lat1 * sin_lat2)
+            lats[i + 1] = math.degrees(current_lat)
+            lons[i + 1] = math.degrees(current_lon)
+
+        return lats, lons
+
+    # Two-pass parallel variant for long tracks: pass 1 approximates the
+    # latitude evolution on the local tangent plane with a cumulative sum
+    # (the per-step displacements are independent of each other), pass 2
+    # applies the exact spherical step from each approximated latitude in
+    # parallel. Valid while the track spans only a few degrees of latitude,
+    # which the dispatcher below checks before choosing this kernel.
+    @njit(cache=True, fastmath=True, parallel=True, nogil=True)
+    def _integrate_parallel(ground_speed_knots, heading_deg, initial_lat, initial_lon, time_interval_seconds):
+        n = ground_speed_knots.shape[0]
+        step_scale = KNOTS_TO_METERS_PER_SECOND * time_interval_seconds / EARTH_RADIUS_METERS
+        d = ground_speed_knots * step_scale
+        heading = np.deg2rad(heading_deg)
+
+        lat0 = math.radians(initial_lat)
+        lat_approx = lat0 + np.cumsum(d * np.cos(heading))
+
+        lats = np.empty(n + 1, dtype=np.float64)
+        lons = np.empty(n + 1, dtype=np.float64)
+        dlon = np.empty(n, dtype=np.float64)
+        lats[0] = initial_lat
+        lons[0] = initial_lon
+        for i in prange(n):
+            lat1 = lat0 if i == 0 else lat_approx[i - 1]
+            sin_d = math.sin(d[i])
+            cos_d = math.cos(d[i])
+            sin_lat1 = math.sin(lat1)
+            cos_lat1 = math.cos(lat1)
+            sin_lat2 = sin_lat1 * cos_d + cos_lat1 * sin_d * math.cos(heading[i])
+            lats[i + 1] = math.degrees(math.asin(sin_lat2))
+            dlon[i] = math.atan2(math.sin(heading[i]) * sin_d * cos_lat1, cos_d - sin_lat1 * sin_lat2)
+
+        # Longitude increments only couple through their sum
+        lons[1:] = np.degrees(math.radians(initial_lon) + np.cumsum(dlon))
+        return lats, lons
+
+    # Warmup calls so compilation happens here, once, not on the first Run
+    _integrate(np.zeros(1), np.zeros(1), 0.0, 0.0, 1.0)
+    _integrate_parallel(np.zeros(1), np.zeros(1), 0.0, 0.0, 1.0)
+
+    def integrate(ground_speed_knots, heading_deg, initial_lat, initial_lon, time_interval_seconds):
+        # Cheap equirectangular preview of the latitude evolution decides
+        # whether the parallel kernel's approximation is safe
+        if ground_speed_knots.shape[0] >= _PARALLEL_MIN_STEPS:
+            step_scale = KNOTS_TO_METERS_PER_SECOND * time_interval_seconds / EARTH_RADIUS_METERS
+            dlat = ground_speed_knots * step_scale * np.cos(np.deg2rad(heading_deg))
+            if np.ptp(np.cumsum(dlat)) < _PARALLEL_MAX_LAT_SPAN_RAD:
+                return _integrate_parallel(ground_speed_knots, heading_deg, initial_lat, initial_lon, time_interval_seconds)
+        return _integrate(ground_speed_knots, heading_deg, initial_lat, initial_lon, time_interval_seconds)
+
+    return integrate
+
+# Read input CSV data and predict coordinates. Cached on the raw file bytes
+# plus the scalar inputs, so reruns with unchanged inputs (e.g. after a
+# download-button click) skip both the parse and the integration.
+@st.cache_data(show_spinner=False)
+def read_csv_and_predict(csv_bytes, initial_lat, initial_lon, time_interval_seconds=1):
+    input_csv = io.BytesIO(csv_bytes)
+
+    # Read only the header row first to resolve column names case-insensitively
+    header = pd.read_csv(input_csv, nrows=0)
+    column_map = {name.lower(): name for name in header.columns}
 
     # Ensure the required columns are present (case-insensitive)
     required_columns = ['groundspeed', 'heading']
-    df.columns = df.columns.str.lower()
-    missing_columns = [col for col in required_columns if col not in df.columns]
+    missing_columns = [col for col in required_columns if col not in column_map]
     if missing_columns:
         raise ValueError(f"Missing required columns: {', '.join(missing_columns)}")
 
-    # Initialize initial coordinates
-    current_lat, current_lon = initial_lat, initial_lon
-
-    # List to store predicted data
-    predicted_data = []
-
-    # Append initial coordinates data to list
-    predicted_data.append({
-        'latitude': current_lat,
-        'longitude': current_lon,
-        'name': 1  # First step
-    })
-
-    # Predict latitude and longitude for subsequent rows
-    for index, row in df.iterrows():
-        step_number = index + 1  # Step number starts from 1 for the first row
-        ground_speed_knots = row['groundspeed']
-        bearing = row['heading']
-
-        # Calculate new coordinates based on current coordinates and ground speed
-        new_lat, new_lon = calculate_new_coordinates(current_lat, current_lon, bearing, ground_speed_knots, time_interval_seconds)
-
-        # Append predicted data to list
-        predicted_data.append({
-            'latitude': new_lat,
-            'longitude': new_lon,
-            'name': step_number
-        })
-
-        # Update current coordinates to newly calculated values
-        current_lat, current_lon = new_lat, new_lon
-
-    return predicted_data, current_lat, current_lon  # Return final coordinates after prediction
-
-# Function to write predicted data to CSV file
-def write_to_csv(predicted_data, output_csv):
-    df = pd.DataFrame(predicted_data)
-    df.to_csv(output_csv, index=False)
+    # Re-read just the two needed columns as float64 with the C engine,
+    # skipping parse work and dtype inference for everything else
+    usecols = [column_map[col] for col in required_columns]
+    input_csv.seek(0)  # rewind after the header read
+    df = pd.read_csv(input_csv, usecols=usecols, dtype={name: np.float64 for name in usecols}, engine='c')
+    df.columns = df.columns.str.lower()
 
-# Function to write predicted data to KML file
-def write_to_kml(predicted_data, output_kml):
-    kml = simplekml.Kml()
-    for data in predicted_data:
-        kml.newpoint(name=f"Step {data['name']}", coords=[(data['longitude'], data['latitude'])])
-    kml.save(output_kml)
+    # Pull the two input columns out as float64 arrays and run the whole
+    # recurrence in the compiled kernel
+    ground_speed_knots = df['groundspeed'].to_numpy(dtype=np.float64)
+    heading_deg = df['heading'].to_numpy(dtype=np.float64)
+    integrate = _get_integrator()
+    lats, lons = integrate(ground_speed_knots, heading_deg, float(initial_lat), float(initial_lon), float(time_interval_seconds))
+
+    # Step numbers for each point, starting at 1 for the initial coordinates
+    names = np.arange(1, len(lats) + 1, dtype=np.int64)
+
+    return lats, lons, names
+
+# Vectorized haversine: great-circle distance in meters between paired
+# coordinate arrays, one ufunc pass instead of a Python call per point.
+# Also the hook for any future predicted-vs-ground-truth validation.
+def _haversine_vec(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(a))
+
+# Function to serialize predicted data as CSV bytes
+@st.cache_data(show_spinner=False)
+def write_to_csv(lats, lons, names):
+    # Arrow wraps the NumPy arrays zero-copy and writes the CSV in C++,
+    # which is several times faster than pandas' to_csv on long tracks
+    table = pa.table({'latitude': lats, 'longitude': lons, 'name': names})
+    sink = pa.BufferOutputStream()
+    pacsv.write_csv(table, sink)
+    return sink.getvalue().to_pybytes()
+
+_KML_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<kml xmlns="http://www.opengis.net/kml/2.2">\n'
+               '<Document>\n')
+_KML_FOOTER = '</Document>\n</kml>\n'
+
+# Function to serialize predicted data as KML bytes
+@st.cache_data(show_spinner=False)
+def write_to_kml(lats, lons, names):
+    # float32 still resolves coordinates to about a meter, plenty for the
+    # %.6f output format, and halves the bytes pushed through the formatter;
+    # the integrator itself stays float64 so drift does not accumulate
+    data = np.column_stack((names.astype(np.float32), lons.astype(np.float32), lats.astype(np.float32)))
+    buf = io.StringIO()
+    np.savetxt(
+        buf,
+        data,
+        fmt='<Placemark><name>Step %d</name><Point><coordinates>%.6f,%.6f</coordinates></Point></Placemark>'
+    )
+    return (_KML_HEADER + buf.getvalue() + _KML_FOOTER).encode()
+
+# Leaflet page rendered directly into a Streamlit component; __POINTS__ and
+# __MARKERS__ are replaced with JSON arrays. Emitting the HTML ourselves
+# skips building one folium wrapper object per map element just to have it
+# serialize itself back into this same JavaScript.
+_MAP_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"/>
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>html, body, #map { margin: 0; width: 100%; height: 100%; }</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+var points = __POINTS__;
+var markers = __MARKERS__;
+var map = L.map('map').setView(points[0], 13);
+L.tileLayer('https://tile.openstreetmap.org/{z}/{x}/{y}.png', {
+    maxZoom: 19,
+    attribution: '&copy; OpenStreetMap contributors'
+}).addTo(map);
+L.polyline(points, {color: 'blue', weight: 5, opacity: 1}).addTo(map);
+markers.forEach(function (m) {
+    L.circleMarker([m[0], m[1]], {radius: 1, color: 'blue', fill: true}).bindPopup('Step ' + m[2]).addTo(map);
+});
+</script>
+</body>
+</html>
+"""
 
 # Function to plot predicted data on a satellite map
-def plot_predicted_data_on_map(predicted_data):
-    # Create a map centered at the initial coordinates
-    initial_coords = (predicted_data[0]['latitude'], predicted_data[0]['longitude'])
-    map_ = folium.Map(location=initial_coords, zoom_start=13, tiles='OpenStreetMap')
-
-    # Custom icon for smaller size
-    icon_url = 'https://raw.githubusercontent.com/pointhi/leaflet-color-markers/master/img/marker-icon-blue.png'
-
-    # Add a marker for each predicted coordinate
-    for data in predicted_data:
-        folium.Marker(
-            location=(data['latitude'], data['longitude']),
-            popup=f"Step {data['name']}",
-            icon=folium.CustomIcon(icon_url, icon_size=(2, 2))
-        ).add_to(map_)
-
-    # Draw lines between the points
-    points = [(data['latitude'], data['longitude']) for data in predicted_data]
-    folium.PolyLine(points, color="blue", weight=5, opacity=1).add_to(map_)  # Set weight to 5 for a thicker line
-
-    # Display the map in Streamlit
-    folium_static(map_)
-
-# Streamlit app
-def main():
-    st.title("Aircraft Trajectory Predictor")
-
-    # Description on how to use the app
-    st.markdown("""
+def plot_predicted_data_on_map(lats, lons, names):
+    # Map rendering does not need float64 resolution either (see write_to_kml)
+    lats = lats.astype(np.float32)
+    lons = lons.astype(np.float32)
+
+    # Polyline points in a single C pass
+    points = np.column_stack((lats, lons)).tolist()
+
+    # A marker per point makes the browser grind to a halt on hour-long
+    # 1-Hz tracks; the polyline carries the shape, so only mark about 50
+    # evenly spaced steps plus the final point
+    stride = max(1, len(lats) // 50)
+    marker_indices = list(range(0, len(lats), stride))
+    if marker_indices[-1] != len(lats) - 1:
+        marker_indices.append(len(lats) - 1)
+    markers = [points[i] + [int(names[i])] for i in marker_indices]
+
+    # orjson serializes the float arrays at C speed; display in Streamlit
+    html = (_MAP_TEMPLATE
+            .replace('__POINTS__', orjson.dumps(points).decode())
+            .replace('__MARKERS__', orjson.dumps(markers).decode()))
+    components.html(html, height=600)
+
+# Static instruction text, built once at import instead of on every rerun
+_INSTRUCTIONS_MD = """
     ### Instructions for Using the App
 
     1. **Upload a CSV File**: Click on the "Choose a CSV file" button to upload your data file. 
@@ -149,7 +282,14 @@ def main():
     - Data with higher resolution (more decimal places) will also improve accuracy.
     - Higher frequencies of data produce more accurate tracks but ensure all data remains at the same frequency.
     - To assess the reliability of the predicted track, compare it to a reliable coordinate such as a landing/takeoff runway or the lat/long of a known waypoint.
-    """)
+    """
+
+# Streamlit app
+def main():
+    st.title("Aircraft Trajectory Predictor")
+
+    # Description on how to use the app
+    st.markdown(_INSTRUCTIONS_MD)
 
     # File uploader for input CSV
     uploaded_file = st.file_uploader("Choose a CSV file", type="csv")
@@ -163,38 +303,41 @@ def main():
     if st.button("Run"):
         if uploaded_file is not None:
             try:
-                # Predict data
-                predicted_data, final_lat, final_lon = read_csv_and_predict(uploaded_file, initial_lat, initial_lon, time_interval_seconds)
+                # Predict data (cached across reruns for identical inputs)
+                lats, lons, names = read_csv_and_predict(uploaded_file.getvalue(), initial_lat, initial_lon, time_interval_seconds)
+                final_lat, final_lon = lats[-1], lons[-1]
 
-                # Write predicted data to CSV
-                output_csv = 'predicted_trajectory.csv'
-                write_to_csv(predicted_data, output_csv)
+                # Serialize predicted data in memory; no disk round trip, and
+                # the bytes are memoized alongside the prediction itself
+                csv_bytes = write_to_csv(lats, lons, names)
+                kml_bytes = write_to_kml(lats, lons, names)
 
-                # Write predicted data to KML
-                output_kml = 'predicted_trajectory.kml'
-                write_to_kml(predicted_data, output_kml)
-
-                st.success(f"Predicted coordinates have been written to {output_csv} and {output_kml}")
+                st.success("Predicted coordinates are ready to download as CSV or KML")
                 st.write(f"Final coordinates: Latitude = {final_lat}, Longitude = {final_lon}")
 
+                # Total along-track distance, handy for sanity-checking the
+                # prediction against the flight plan
+                track_length_m = _haversine_vec(lats[:-1], lons[:-1], lats[1:], lons[1:]).sum()
+                st.write(f"Total predicted track distance: {track_length_m / 1852:.1f} NM ({track_length_m / 1000:.1f} km)")
+
                 # Provide download link for the output CSV
                 st.download_button(
                     label="Download Predicted Trajectory CSV",
-                    data=open(output_csv, "rb"),
-                    file_name=output_csv,
+                    data=csv_bytes,
+                    file_name='predicted_trajectory.csv',
                     mime="text/csv"
                 )
 
                 # Provide download link for the output KML
                 st.download_button(
                     label="Download Predicted Trajectory KML (Google Earth)",
-                    data=open(output_kml, "rb"),
-                    file_name=output_kml,
+                    data=kml_bytes,
+                    file_name='predicted_trajectory.kml',
                     mime="application/vnd.google-earth.kml+xml"
                 )
 
                 # Plot predicted data on a satellite map
-                plot_predicted_data_on_map(predicted_data)
+                plot_predicted_data_on_map(lats, lons, names)
 
             except ValueError as e:
                 st.error(e)